@@ -1,17 +1,18 @@
 import os
 import uuid
 import base64
-import json
 import asyncio
-from datetime import datetime, timezone
-from typing import Dict, Any, Optional, Iterable, List
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional, Iterable, List, Callable, Awaitable, AsyncIterator
 
 import aiohttp
 import asyncpg
+import orjson
+from cachetools import TTLCache
 
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
 
@@ -33,134 +34,196 @@ from peremen import (
 # ---------------- PostgreSQL (asyncpg) ----------------
 pool: Optional[asyncpg.Pool] = None
 
+# Недавно виденные пользователи -> is_subscribed: повторные нажатия в течение минуты не ходят в БД.
+# Пишет в users только этот процесс, поэтому кэш обновляем в set_subscribed/remove_users.
+recent_users: "TTLCache[int, bool]" = TTLCache(maxsize=10_000, ttl=60)
+
+
+# Горячие запросы готовим один раз на каждое новое соединение (см. prepare_statements)
+HOT_SQL = {
+    # updated_at трогаем только при реальных изменениях (подписка, платёж),
+    # повторные заходы существующего пользователя ничего не пишут.
+    # DO NOTHING не возвращает строку при конфликте — добираем её обычным SELECT
+    "upsert_and_get_sub": """
+        WITH ins AS (
+            INSERT INTO users (user_id, is_subscribed, created_at, updated_at)
+            VALUES ($1, FALSE, $2, $2)
+            ON CONFLICT (user_id) DO NOTHING
+            RETURNING is_subscribed
+        )
+        SELECT is_subscribed FROM ins
+        UNION ALL
+        SELECT is_subscribed FROM users WHERE user_id=$1
+        LIMIT 1;
+    """,
+    "set_subscribed": """
+        INSERT INTO users (user_id, is_subscribed, created_at, updated_at)
+        VALUES ($1, $2, $3, $3)
+        ON CONFLICT (user_id) DO UPDATE
+        SET is_subscribed = EXCLUDED.is_subscribed,
+            updated_at = EXCLUDED.updated_at;
+    """,
+    "save_last_payment": """
+        INSERT INTO payments (user_id, payment_id, updated_at)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (user_id) DO UPDATE
+        SET payment_id = EXCLUDED.payment_id,
+            updated_at = EXCLUDED.updated_at;
+    """,
+    "get_last_payment": "SELECT payment_id FROM payments WHERE user_id=$1",
+}
+
+
+class BotConnection(asyncpg.Connection):
+    # у asyncpg.Connection есть __slots__, поэтому храним стейтменты в подклассе
+    stmts: Dict[str, asyncpg.prepared_stmt.PreparedStatement]
+
+
+async def prepare_statements(conn: BotConnection) -> None:
+    # init-хук пула: вызывается один раз при открытии соединения.
+    # Таблицы должны уже существовать, поэтому db_init идёт до create_pool.
+    conn.stmts = {name: await conn.prepare(sql) for name, sql in HOT_SQL.items()}
+
 
 def now_utc() -> datetime:
     return datetime.now(timezone.utc)
 
 
-async def db_init() -> None:
-    assert pool is not None
-    async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                is_subscribed BOOLEAN NOT NULL DEFAULT FALSE,
-                created_at TIMESTAMPTZ NOT NULL,
-                updated_at TIMESTAMPTZ NOT NULL
-            );
-            """
-        )
-        await conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS payments (
-                user_id BIGINT PRIMARY KEY,
-                payment_id TEXT NOT NULL,
-                updated_at TIMESTAMPTZ NOT NULL
-            );
-            """
-        )
+async def db_init(conn: asyncpg.Connection) -> None:
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            is_subscribed BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMPTZ NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL
+        );
+        """
+    )
+    # Частичный индекс под рассылки и счётчики подписчиков (WHERE is_subscribed=TRUE)
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS users_subscribed_idx ON users(user_id) WHERE is_subscribed = TRUE;"
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            user_id BIGINT PRIMARY KEY,
+            payment_id TEXT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL
+        );
+        """
+    )
 
 
-async def upsert_user(user_id: int) -> None:
+async def upsert_and_get_sub(user_id: int) -> bool:
+    # upsert + чтение подписки за один round trip
+    cached = recent_users.get(user_id)
+    if cached is not None:
+        return cached
     assert pool is not None
     now = now_utc()
     async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO users (user_id, is_subscribed, created_at, updated_at)
-            VALUES ($1, FALSE, $2, $2)
-            ON CONFLICT (user_id) DO UPDATE
-            SET updated_at = EXCLUDED.updated_at;
-            """,
-            user_id,
-            now,
-        )
+        sub = await conn.stmts["upsert_and_get_sub"].fetchval(user_id, now)
+    recent_users[user_id] = bool(sub)
+    return bool(sub)
 
 
 async def set_subscribed(user_id: int, subscribed: bool) -> None:
     assert pool is not None
     now = now_utc()
     async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO users (user_id, is_subscribed, created_at, updated_at)
-            VALUES ($1, $2, $3, $3)
-            ON CONFLICT (user_id) DO UPDATE
-            SET is_subscribed = EXCLUDED.is_subscribed,
-                updated_at = EXCLUDED.updated_at;
-            """,
-            user_id,
-            subscribed,
-            now,
-        )
+        await conn.stmts["set_subscribed"].fetchval(user_id, subscribed, now)
+    recent_users[user_id] = subscribed
 
 
-async def get_subscribed(user_id: int) -> bool:
+async def remove_users(user_ids: List[int]) -> None:
     assert pool is not None
+    if not user_ids:
+        return
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT is_subscribed FROM users WHERE user_id=$1",
-            user_id,
+        await conn.execute(
+            """
+            WITH d AS (DELETE FROM users WHERE user_id = ANY($1::bigint[]))
+            DELETE FROM payments WHERE user_id = ANY($1::bigint[]);
+            """,
+            user_ids,
         )
-    return bool(row and row["is_subscribed"])
+    for user_id in user_ids:
+        recent_users.pop(user_id, None)
 
 
-async def remove_user(user_id: int) -> None:
-    assert pool is not None
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            await conn.execute("DELETE FROM users WHERE user_id=$1", user_id)
-            await conn.execute("DELETE FROM payments WHERE user_id=$1", user_id)
+SUBSCRIBERS_BATCH = 1000
 
 
-async def get_subscribers() -> List[int]:
+async def iter_subscribers() -> AsyncIterator[int]:
+    # Читаем id порциями по ключу (user_id > последний), без долгой транзакции:
+    # соединение берём только на время одного запроса
+    assert pool is not None
+    last_id = 0  # user_id в Telegram положительные
+    while True:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT user_id FROM users
+                WHERE is_subscribed=TRUE AND user_id > $1
+                ORDER BY user_id
+                LIMIT $2
+                """,
+                last_id,
+                SUBSCRIBERS_BATCH,
+            )
+        for r in rows:
+            yield int(r["user_id"])
+        if len(rows) < SUBSCRIBERS_BATCH:
+            return
+        last_id = int(rows[-1]["user_id"])
+
+
+async def count_subscribers() -> int:
     assert pool is not None
     async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT user_id FROM users WHERE is_subscribed=TRUE")
-    return [int(r["user_id"]) for r in rows]
+        subs = await conn.fetchval("SELECT COUNT(*) FROM users WHERE is_subscribed=TRUE")
+    return int(subs)
 
 
 async def count_users() -> tuple[int, int]:
     assert pool is not None
     async with pool.acquire() as conn:
-        total = await conn.fetchval("SELECT COUNT(*) FROM users")
-        subs = await conn.fetchval("SELECT COUNT(*) FROM users WHERE is_subscribed=TRUE")
-    return int(total), int(subs)
+        row = await conn.fetchrow(
+            "SELECT COUNT(*) AS total, COUNT(*) FILTER (WHERE is_subscribed) AS subs FROM users"
+        )
+    return int(row["total"]), int(row["subs"])
 
 
 async def save_last_payment(user_id: int, payment_id: str) -> None:
     assert pool is not None
     now = now_utc()
     async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO payments (user_id, payment_id, updated_at)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (user_id) DO UPDATE
-            SET payment_id = EXCLUDED.payment_id,
-                updated_at = EXCLUDED.updated_at;
-            """,
-            user_id,
-            payment_id,
-            now,
-        )
+        await conn.stmts["save_last_payment"].fetchval(user_id, payment_id, now)
 
 
 async def get_last_payment(user_id: int) -> Optional[str]:
     assert pool is not None
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT payment_id FROM payments WHERE user_id=$1",
-            user_id,
-        )
+        row = await conn.stmts["get_last_payment"].fetchrow(user_id)
     return str(row["payment_id"]) if row else None
 
 
 # ---------------- YooKassa ----------------
-def yookassa_auth_header() -> str:
-    token = base64.b64encode(f"{YOO_SHOP_ID}:{YOO_SECRET}".encode()).decode()
-    return f"Basic {token}"
+# Одна сессия на весь процесс: keep-alive к api.yookassa.ru вместо TLS-рукопожатия на каждый запрос
+http: Optional[aiohttp.ClientSession] = None
+
+# Креды — константы из peremen.py, заголовок считаем один раз
+YK_AUTH = "Basic " + base64.b64encode(f"{YOO_SHOP_ID}:{YOO_SECRET}".encode()).decode()
+YK_GET_HEADERS = {"Authorization": YK_AUTH}
+
+
+async def yk_read(resp: aiohttp.ClientResponse) -> Dict[str, Any]:
+    # orjson парсит сырые байты; в str декодируем только тело ошибки
+    body = await resp.read()
+    if resp.status >= 400:
+        raise RuntimeError(f"YooKassa error {resp.status}: {body.decode(errors='replace')}")
+    return orjson.loads(body)
 
 
 async def yk_create_payment(user_id: int) -> Dict[str, Any]:
@@ -177,45 +240,77 @@ async def yk_create_payment(user_id: int) -> Dict[str, Any]:
     }
 
     headers = {
-        "Authorization": yookassa_auth_header(),
+        "Authorization": YK_AUTH,
         "Content-Type": "application/json",
         "Idempotence-Key": idempotence_key,
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            "https://api.yookassa.ru/v3/payments",
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=20,
-        ) as resp:
-            text = await resp.text()
-            if resp.status >= 400:
-                raise RuntimeError(f"YooKassa error {resp.status}: {text}")
-            return json.loads(text)
+    assert http is not None
+    async with http.post(
+        "https://api.yookassa.ru/v3/payments",
+        headers=headers,
+        data=orjson.dumps(payload),
+    ) as resp:
+        return await yk_read(resp)
 
 
 async def yk_get_payment(payment_id: str) -> Dict[str, Any]:
-    headers = {"Authorization": yookassa_auth_header()}
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f"https://api.yookassa.ru/v3/payments/{payment_id}",
-            headers=headers,
-            timeout=20,
-        ) as resp:
-            text = await resp.text()
-            if resp.status >= 400:
-                raise RuntimeError(f"YooKassa error {resp.status}: {text}")
-            return json.loads(text)
+    assert http is not None
+    async with http.get(
+        f"https://api.yookassa.ru/v3/payments/{payment_id}",
+        headers=YK_GET_HEADERS,
+    ) as resp:
+        return await yk_read(resp)
 
 
-async def issue_invite_link(bot: Bot) -> str:
+# Запас одноразовых ссылок: выдача доступа не ждёт createChatInviteLink
+INVITE_POOL_SIZE = 5
+INVITE_LINK_TTL = timedelta(days=1)
+INVITE_LINK_MIN_LEFT = timedelta(hours=1)
+invite_links: "asyncio.Queue[tuple[str, datetime]]" = asyncio.Queue(maxsize=INVITE_POOL_SIZE)
+# Сигнал рефиллеру, что из очереди забрали ссылку и есть место
+invite_link_taken = asyncio.Event()
+
+
+async def mint_invite_link(bot: Bot) -> tuple[str, datetime]:
+    expires = now_utc() + INVITE_LINK_TTL
     invite = await bot.create_chat_invite_link(
         chat_id=PRIVATE_CHANNEL_ID,
         member_limit=1,
         creates_join_request=False,
+        expire_date=expires,
     )
-    return invite.invite_link
+    return invite.invite_link, expires
+
+
+async def refill_invite_links(bot: Bot) -> None:
+    # Фоновая задача: держит очередь заполненной.
+    # Сначала ждём свободное место, потом выпускаем — чтобы ссылка не старела, лёжа в ожидании
+    while True:
+        while invite_links.full():
+            invite_link_taken.clear()
+            await invite_link_taken.wait()
+        try:
+            item = await mint_invite_link(bot)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after + 0.5)
+            continue
+        except Exception:
+            # нет прав в канале и т.п. — пробуем позже, ошибку увидит issue_invite_link
+            await asyncio.sleep(30)
+            continue
+        invite_links.put_nowait(item)  # кладёт только рефиллер, место уже есть
+
+
+async def issue_invite_link(bot: Bot) -> str:
+    # Берём готовую ссылку; протухшие выкидываем, если запас пуст — выпускаем на месте
+    while not invite_links.empty():
+        link, expires = invite_links.get_nowait()
+        invite_link_taken.set()
+        if expires - now_utc() > INVITE_LINK_MIN_LEFT:
+            return link
+    link, _ = await mint_invite_link(bot)
+    return link
 
 
 # ---------------- UI ----------------
@@ -237,6 +332,36 @@ def menu_kb(subscribed: bool) -> InlineKeyboardBuilder:
     return kb
 
 
+# Клавиатур всего две — собираем их один раз
+MENU_SUB = menu_kb(True).as_markup()
+MENU_UNSUB = menu_kb(False).as_markup()
+
+
+def menu(subscribed: bool) -> InlineKeyboardMarkup:
+    return MENU_SUB if subscribed else MENU_UNSUB
+
+
+# Тексты с константами из peremen.py собираем один раз
+START_TEXT = (
+    "👋 Привет!\n\n"
+    "Это бот участия в челлендже.\n"
+    f"💰 Стоимость: {PRICE_RUB} ₽\n\n"
+    "Как пройти:\n"
+    "1) Нажми «Оплатить»\n"
+    "2) Оплати по ссылке\n"
+    "3) Нажми «Проверить оплату»\n"
+    "4) Нажми «Получить доступ»\n\n"
+    "Хочешь получать анонсы/старты — включи рассылку 🔔"
+)
+
+BROADCAST_DONE_TEXT = (
+    "✅ Рассылка завершена.\n"
+    "Доставлено: {ok}\n"
+    "Заблокировали бота/нет доступа: {blocked}\n"
+    "Ошибки: {failed}"
+)
+
+
 dp = Dispatcher()
 
 
@@ -244,28 +369,15 @@ dp = Dispatcher()
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
     user_id = message.from_user.id
-    await upsert_user(user_id)
-
-    sub = await get_subscribed(user_id)
-    await message.answer(
-        "👋 Привет!\n\n"
-        f"Это бот участия в челлендже.\n"
-        f"💰 Стоимость: {PRICE_RUB} ₽\n\n"
-        "Как пройти:\n"
-        "1) Нажми «Оплатить»\n"
-        "2) Оплати по ссылке\n"
-        "3) Нажми «Проверить оплату»\n"
-        "4) Нажми «Получить доступ»\n\n"
-        "Хочешь получать анонсы/старты — включи рассылку 🔔",
-        reply_markup=menu_kb(sub).as_markup(),
-    )
+    sub = await upsert_and_get_sub(user_id)
+    await message.answer(START_TEXT, reply_markup=menu(sub))
 
 
 @dp.message(Command("menu"))
 async def cmd_menu(message: Message):
     user_id = message.from_user.id
-    await upsert_user(user_id)
-    await message.answer("Меню 👇", reply_markup=menu_kb(await get_subscribed(user_id)).as_markup())
+    sub = await upsert_and_get_sub(user_id)
+    await message.answer("Меню 👇", reply_markup=menu(sub))
 
 
 @dp.message(Command("whoami"))
@@ -285,15 +397,13 @@ async def cmd_stats(message: Message):
 @dp.callback_query(F.data == "toggle_sub")
 async def cb_toggle_sub(call: CallbackQuery):
     user_id = call.from_user.id
-    await upsert_user(user_id)
-
-    current = await get_subscribed(user_id)
+    current = await upsert_and_get_sub(user_id)
     await set_subscribed(user_id, not current)
 
     await call.answer("Готово ✅")
     await call.message.answer(
         "🔔 Подписка включена." if not current else "🔕 Подписка выключена.",
-        reply_markup=menu_kb(not current).as_markup(),
+        reply_markup=menu(not current),
     )
 
 
@@ -306,8 +416,8 @@ async def cb_support(call: CallbackQuery):
 @dp.callback_query(F.data == "pay")
 async def cb_pay(call: CallbackQuery, bot: Bot):
     user_id = call.from_user.id
-    await upsert_user(user_id)
-    await call.answer()
+    # upsert и ответ на callback независимы — ждём их параллельно
+    sub, _ = await asyncio.gather(upsert_and_get_sub(user_id), call.answer())
 
     try:
         payment = await yk_create_payment(user_id)
@@ -326,17 +436,19 @@ async def cb_pay(call: CallbackQuery, bot: Bot):
         "2) Потом нажми «Проверить оплату» ✅\n"
         "3) И «Получить доступ» 🔗\n\n"
         f"🧾 Payment ID: {payment_id}",
-        reply_markup=menu_kb(await get_subscribed(user_id)).as_markup(),
+        reply_markup=menu(sub),
     )
 
 
 @dp.callback_query(F.data == "check")
 async def cb_check(call: CallbackQuery):
     user_id = call.from_user.id
-    await upsert_user(user_id)
-    await call.answer()
-
-    payment_id = await get_last_payment(user_id)
+    # Независимые запросы к БД и ответ на callback — параллельно
+    sub, payment_id, _ = await asyncio.gather(
+        upsert_and_get_sub(user_id),
+        get_last_payment(user_id),
+        call.answer(),
+    )
     if not payment_id:
         await call.message.answer("❗ Сначала создай платёж: нажми «Оплатить».")
         return
@@ -351,29 +463,31 @@ async def cb_check(call: CallbackQuery):
     if status == "succeeded":
         await call.message.answer(
             "✅ Оплата подтверждена!\nНажми «Получить доступ» 🔗",
-            reply_markup=menu_kb(await get_subscribed(user_id)).as_markup(),
+            reply_markup=menu(sub),
         )
     elif status in ("pending", "waiting_for_capture"):
         await call.message.answer(
             "⏳ Платёж пока обрабатывается.\n"
             "Подожди 10–30 секунд и нажми «Проверить оплату» ещё раз.",
-            reply_markup=menu_kb(await get_subscribed(user_id)).as_markup(),
+            reply_markup=menu(sub),
         )
     else:
         await call.message.answer(
             f"⚠️ Статус платежа: {status}\n"
             "Если оплата не прошла — создай новый платёж кнопкой «Оплатить».",
-            reply_markup=menu_kb(await get_subscribed(user_id)).as_markup(),
+            reply_markup=menu(sub),
         )
 
 
 @dp.callback_query(F.data == "access")
 async def cb_access(call: CallbackQuery, bot: Bot):
     user_id = call.from_user.id
-    await upsert_user(user_id)
-    await call.answer()
-
-    payment_id = await get_last_payment(user_id)
+    # Независимые запросы к БД и ответ на callback — параллельно
+    sub, payment_id, _ = await asyncio.gather(
+        upsert_and_get_sub(user_id),
+        get_last_payment(user_id),
+        call.answer(),
+    )
     if not payment_id:
         await call.message.answer("❗ Сначала нажми «Оплатить».")
         return
@@ -394,7 +508,7 @@ async def cb_access(call: CallbackQuery, bot: Bot):
     if status != "succeeded":
         await call.message.answer(
             f"⛔ Оплата ещё не подтверждена (status: {status}).\nНажми «Проверить оплату» ✅",
-            reply_markup=menu_kb(await get_subscribed(user_id)).as_markup(),
+            reply_markup=menu(sub),
         )
         return
 
@@ -413,57 +527,108 @@ async def cb_access(call: CallbackQuery, bot: Bot):
     await call.message.answer(
         "🎉 Доступ выдан!\n"
         f"Вот ссылка в закрытый канал:\n{link}",
-        reply_markup=menu_kb(await get_subscribed(user_id)).as_markup(),
+        reply_markup=menu(sub),
     )
 
 
 # ---------------- Рассылки ----------------
+# Сколько отправок держим в полёте одновременно
+BROADCAST_CONCURRENCY = 25
+# Темп рассылки, сообщений в секунду (глобальный лимит Telegram ~30/с)
+BROADCAST_RATE = 25
+# Сколько раз пробуем одному получателю после RetryAfter
+BROADCAST_MAX_ATTEMPTS = 5
+
+
+async def send_to_all(
+    user_ids: AsyncIterator[int],
+    send: Callable[[int], Awaitable[Any]],
+) -> tuple[int, int, int]:
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    counts = {"ok": 0, "blocked": 0, "failed": 0}
+    blocked_ids: List[int] = []
+
+    loop = asyncio.get_running_loop()
+    interval = 1 / BROADCAST_RATE
+    next_start = loop.time()
+    # RetryAfter от Telegram ставит на паузу всех отправителей до этого момента
+    paused_until = 0.0
+
+    async def wait_turn() -> None:
+        # Старты отправок идут не чаще BROADCAST_RATE в секунду и не раньше конца паузы
+        nonlocal next_start
+        while True:
+            now = loop.time()
+            start = max(now, next_start, paused_until)
+            if start <= now:
+                next_start = now + interval
+                return
+            await asyncio.sleep(start - now)
+
+    async def deliver(uid: int) -> str:
+        nonlocal paused_until
+        for _ in range(BROADCAST_MAX_ATTEMPTS):
+            await wait_turn()
+            try:
+                await send(uid)
+                return "ok"
+            except TelegramForbiddenError:
+                blocked_ids.append(uid)
+                return "blocked"
+            except TelegramRetryAfter as e:
+                paused_until = max(paused_until, loop.time() + e.retry_after + 0.5)
+            except Exception:
+                return "failed"
+        return "failed"
+
+    async def send_one(uid: int) -> None:
+        try:
+            counts[await deliver(uid)] += 1
+        finally:
+            sem.release()
+
+    # Отправляем, пока id ещё читаются из БД; в полёте не больше BROADCAST_CONCURRENCY задач
+    tasks: set[asyncio.Task] = set()
+    try:
+        async for uid in user_ids:
+            await sem.acquire()
+            task = asyncio.create_task(send_one(uid))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        # Даже если чтение id упало — дожидаемся начатых отправок и чистим заблокировавших
+        if tasks:
+            await asyncio.gather(*tasks)
+        # Заблокировавших бота удаляем одним запросом в конце
+        await remove_users(blocked_ids)
+    return counts["ok"], counts["blocked"], counts["failed"]
+
+
 @dp.message(Command("broadcast"))
-async def cmd_broadcast(message: Message, bot: Bot):
+async def cmd_broadcast(message: Message, command: CommandObject, bot: Bot):
     if not is_admin(message.from_user.id):
         await message.answer("⛔ Нет доступа.")
         return
 
-    parts = (message.text or "").split(maxsplit=1)
-    if len(parts) < 2:
+    text = (command.args or "").strip()
+    if not text:
         await message.answer("Использование:\n/broadcast Текст рассылки")
         return
 
-    text = parts[1].strip()
-    subscribers = await get_subscribers()
+    subs = await count_subscribers()
 
-    if not subscribers:
+    if not subs:
         await message.answer("Подписчиков на рассылку пока нет (никто не нажал 🔔).")
         return
 
-    await message.answer(f"📣 Старт рассылки: {len(subscribers)} подписчиков...")
-
-    ok = blocked = failed = 0
-    for uid in subscribers:
-        try:
-            await bot.send_message(uid, text)
-            ok += 1
-            await asyncio.sleep(0.05)
-        except TelegramForbiddenError:
-            blocked += 1
-            await remove_user(uid)
-        except TelegramRetryAfter as e:
-            await asyncio.sleep(e.retry_after + 0.5)
-            try:
-                await bot.send_message(uid, text)
-                ok += 1
-            except Exception:
-                failed += 1
-        except Exception:
-            failed += 1
+    await message.answer(f"📣 Старт рассылки: {subs} подписчиков...")
 
-    await message.answer(
-        "✅ Рассылка завершена.\n"
-        f"Доставлено: {ok}\n"
-        f"Заблокировали бота/нет доступа: {blocked}\n"
-        f"Ошибки: {failed}"
+    ok, blocked, failed = await send_to_all(
+        iter_subscribers(), lambda uid: bot.send_message(uid, text)
     )
 
+    await message.answer(BROADCAST_DONE_TEXT.format(ok=ok, blocked=blocked, failed=failed))
+
 
 @dp.message(Command("broadcast_here"))
 async def cmd_broadcast_here(message: Message, bot: Bot):
@@ -475,45 +640,24 @@ async def cmd_broadcast_here(message: Message, bot: Bot):
         await message.answer("Использование: ответь на сообщение командой /broadcast_here")
         return
 
-    subscribers = await get_subscribers()
-    if not subscribers:
+    subs = await count_subscribers()
+    if not subs:
         await message.answer("Подписчиков на рассылку пока нет (никто не нажал 🔔).")
         return
 
-    await message.answer(f"📎 Рассылка копией сообщения: {len(subscribers)} подписчиков...")
+    await message.answer(f"📎 Рассылка копией сообщения: {subs} подписчиков...")
 
-    ok = blocked = failed = 0
     src = message.reply_to_message
-
-    for uid in subscribers:
-        try:
-            await src.copy_to(chat_id=uid)
-            ok += 1
-            await asyncio.sleep(0.05)
-        except TelegramForbiddenError:
-            blocked += 1
-            await remove_user(uid)
-        except TelegramRetryAfter as e:
-            await asyncio.sleep(e.retry_after + 0.5)
-            try:
-                await src.copy_to(chat_id=uid)
-                ok += 1
-            except Exception:
-                failed += 1
-        except Exception:
-            failed += 1
-
-    await message.answer(
-        "✅ Рассылка завершена.\n"
-        f"Доставлено: {ok}\n"
-        f"Заблокировали бота/нет доступа: {blocked}\n"
-        f"Ошибки: {failed}"
+    ok, blocked, failed = await send_to_all(
+        iter_subscribers(), lambda uid: src.copy_to(chat_id=uid)
     )
 
+    await message.answer(BROADCAST_DONE_TEXT.format(ok=ok, blocked=blocked, failed=failed))
+
 
 # ---------------- Main ----------------
 async def main():
-    global pool
+    global pool, http
 
     if not BOT_TOKEN or "PASTE_" in BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN не задан в peremen.py")
@@ -525,27 +669,61 @@ async def main():
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL не задан. Добавь в Railway Variables или в peremen.py")
 
-    # Создаём пул Postgres
+    # Схему создаём до пула: init-хук пула готовит запросы к этим таблицам
+    conn = await asyncpg.connect(dsn=DATABASE_URL)
+    try:
+        await db_init(conn)
+    finally:
+        await conn.close()
+
+    # Создаём пул Postgres.
+    # Размер: (одновременные задачи × доля, которой нужен коннект) + запас —
+    # рассылка держит до BROADCAST_CONCURRENCY задач, плюс обычные апдейты.
+    max_size = max(10, BROADCAST_CONCURRENCY + 4)
+    min_size = max(2, max_size // 4)
     pool = await asyncpg.create_pool(
         dsn=DATABASE_URL,
-        min_size=1,
-        max_size=5,
-        command_timeout=30,
+        min_size=min_size,
+        max_size=max_size,
+        max_inactive_connection_lifetime=300,
+        command_timeout=10,
+        connection_class=BotConnection,
+        init=prepare_statements,
     )
 
-    await db_init()
+    # Прогрев: сразу открываем все соединения (TLS, авторизация, prepare),
+    # чтобы первые пользователи не ждали рукопожатий
+    conns = await asyncio.gather(*(pool.acquire() for _ in range(pool.get_max_size())))
+    await asyncio.gather(*(pool.release(c) for c in conns))
+
+    # HTTP-сессия для YooKassa (пул соединений живёт всё время работы бота)
+    http = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=75),
+        timeout=aiohttp.ClientTimeout(total=20),
+    )
 
     bot = Bot(BOT_TOKEN)
 
     # чтобы polling не конфликтовал с webhook
     await bot.delete_webhook(drop_pending_updates=True)
 
+    refiller = asyncio.create_task(refill_invite_links(bot))
+
     # Не слушаем channel_post, чтобы не ломаться от канала
     await dp.start_polling(bot, allowed_updates=["message", "callback_query"])
 
-    # Аккуратно закрываем пул
+    # Аккуратно закрываем пул и HTTP-сессию
+    refiller.cancel()
+    await http.close()
     await pool.close()
 
 
 if __name__ == "__main__":
+    # uvloop быстрее стандартного цикла; под Windows его нет — тогда работаем на asyncio
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     asyncio.run(main())